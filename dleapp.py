@@ -94,6 +94,7 @@ def main():
             casedata = {}
             
         crunch_artifacts(list(loader.plugins), extracttype, input_path, out_params, 1, wrap_text, loader, casedata)
+        close_log_files()
 
 def crunch_artifacts(
         plugins: typing.Sequence[plugin_loader.PluginSpec], extracttype, input_path, out_params, ratio, wrap_text, casedata):
@@ -184,6 +185,7 @@ def crunch_artifacts(
         categories_searched += 1
         GuiWindow.SetProgressBar(categories_searched * ratio)
     log.close()
+    close_sidecar_dbs()
 
     logfunc('')
     logfunc('Processes completed.')
@@ -250,6 +250,7 @@ while True:
                 
             crunch_successful = dleapp.crunch_artifacts(
                 search_list, extracttype, input_path, out_params, len(loader)/s_items, wrap_text, casedata)
+            close_log_files()
             if crunch_successful:
                 report_path = os.path.join(out_params.report_folder_base, 'index.html')
                     
@@ -1,7 +1,10 @@
+import atexit
 import codecs
 import csv
 import datetime
 import json
+import locale
+import mmap
 import os
 import pathlib
 import re
@@ -14,12 +17,34 @@ import magic
 import shutil
 from pathlib import Path
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from functools import lru_cache
 
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+try:
+    from orjson import loads as _json_loads  # several times faster on the log lines gather_hashes_in_file parses
+except ImportError:
+    from json import loads as _json_loads
+
 os.path.basename = lru_cache(maxsize=None)(os.path.basename)
 
 
+class _RE:
+    '''Precompiled regexes used by the functions below'''
+    SANITIZE_PATH = re.compile(r'[*?:"<>|\'\r\n]')
+    SANITIZE_NAME = re.compile(r'[\\/*?:"<>|\'\r\n]')
+    # Well-formed utf-8 byte sequences, as seen when utf-8 is mis-decoded as latin-1 (one char per byte)
+    UTF8_SEQ = re.compile('[\xc2-\xdf][\x80-\xbf]'
+                          '|\xe0[\xa0-\xbf][\x80-\xbf]|[\xe1-\xec\xee\xef][\x80-\xbf]{2}|\xed[\x80-\x9f][\x80-\xbf]'
+                          '|\xf0[\x90-\xbf][\x80-\xbf]{2}|[\xf1-\xf3][\x80-\xbf]{3}|\xf4[\x80-\x8f][\x80-\xbf]{2}')
+    # Items of the comma separated hash list captured by gather_hashes_in_file's regex
+    HASH_TOKEN = re.compile(r'[^,\s]+')
+
+
 class OutputParameters:
     '''Defines the parameters that are common for '''
     # static parameters
@@ -32,6 +57,7 @@ class OutputParameters:
         self.report_folder_base = os.path.join(output_folder,
                                                'DLEAPP_Reports_' + currenttime)  # aleapp , aleappGUI, ileap_artifacts, report.py
         self.temp_folder = os.path.join(self.report_folder_base, 'temp')
+        close_log_files()  # any streams still open belong to a previous run
         OutputParameters.screen_output_file_path = os.path.join(self.report_folder_base, 'Script Logs',
                                                                 'Screen Output.html')
         OutputParameters.screen_output_file_path_devinfo = os.path.join(self.report_folder_base, 'Script Logs',
@@ -46,18 +72,23 @@ def is_platform_windows():
     return os.name == 'nt'
 
 
+_IS_WINDOWS = is_platform_windows()
+
+
+@lru_cache(maxsize=8192)
 def sanitize_file_path(filename, replacement_char='_'):
     '''
     Removes illegal characters (for windows) from the string passed. Does not replace \ or /
     '''
-    return re.sub(r'[*?:"<>|\'\r\n]', replacement_char, filename)
+    return _RE.SANITIZE_PATH.sub(replacement_char, filename)
 
 
+@lru_cache(maxsize=8192)
 def sanitize_file_name(filename, replacement_char='_'):
     '''
     Removes illegal characters (for windows) from the string passed.
     '''
-    return re.sub(r'[\\/*?:"<>|\'\r\n]', replacement_char, filename)
+    return _RE.SANITIZE_NAME.sub(replacement_char, filename)
 
 
 def get_next_unused_name(path):
@@ -69,11 +100,25 @@ def get_next_unused_name(path):
     ext = None
     if basename.find('.') > 0:
         basename, ext = os.path.splitext(basename)
+    # List the folder once instead of stat-ing every candidate. Names are compared lower-cased only
+    # where the filesystem is normally case-insensitive (Windows, macOS).
+    fold_case = _IS_WINDOWS or sys.platform == 'darwin'
+    try:
+        with os.scandir(folder or '.') as entries:
+            existing = {entry.name.lower() if fold_case else entry.name for entry in entries}
+    except OSError:
+        existing = set()
+
+    def name_taken(name, num):
+        if num >= 100:  # past the -99 suffixes, check with the filesystem itself
+            return os.path.exists(os.path.join(folder, name))
+        return (name.lower() if fold_case else name) in existing
+
     num = 1
     new_name = basename
     if ext != None:
         new_name += f"{ext}"
-    while os.path.exists(os.path.join(folder, new_name)):
+    while name_taken(new_name, num):
         new_name = basename + "-{:02}".format(num)
         if ext != None:
             new_name += f"{ext}"
@@ -81,8 +126,8 @@ def get_next_unused_name(path):
     return os.path.join(folder, new_name)
 
 
-def open_sqlite_db_readonly(path):
-    '''Opens an sqlite db in read-only mode, so original db (and -wal/journal are intact)'''
+def _readonly_db_uri(path):
+    '''Returns the sqlite read-only URI for path, percent-encoding the windows long path prefix'''
     if is_platform_windows():
         if path.startswith('\\\\?\\UNC\\'):  # UNC long path
             path = "%5C%5C%3F%5C" + path[4:]
@@ -92,20 +137,29 @@ def open_sqlite_db_readonly(path):
             path = "%5C%5C%3F%5C\\UNC" + path[1:]
         else:  # normal path
             path = "%5C%5C%3F%5C" + path
-    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    return f"file:{path}?mode=ro"
+
+
+def open_sqlite_db_readonly(path):
+    '''Opens an sqlite db in read-only mode, so original db (and -wal/journal are intact)'''
+    db = sqlite3.connect(_readonly_db_uri(path), uri=True)
+    # Reads only, so trade memory for fewer disk reads
+    try:
+        db.executescript('PRAGMA mmap_size = 268435456; PRAGMA cache_size = -20000; PRAGMA temp_store = MEMORY;')
+    except sqlite3.DatabaseError:
+        pass  # not a db, or encrypted. Leave the error to the caller's first query, as before
+    return db
 
 
 def does_column_exist_in_db(db, table_name, col_name):
     '''Checks if a specific col exists'''
     col_name = col_name.lower()
+    query = "SELECT name FROM pragma_table_info(?)"
     try:
         db.row_factory = sqlite3.Row  # For fetching columns by name
-        query = f"pragma table_info('{table_name}');"
-        cursor = db.cursor()
-        cursor.execute(query)
-        all_rows = cursor.fetchall()
-        for row in all_rows:
-            if row['name'].lower() == col_name:
+        cursor = db.execute(query, (table_name,))
+        for row in cursor:
+            if row['name'].lower() == col_name:  # python's lower(), sqlite's NOCASE only folds ascii
                 return True
     except sqlite3.Error as ex:
         print(f"Query error, query={query} Error={str(ex)}")
@@ -115,12 +169,12 @@ def does_column_exist_in_db(db, table_name, col_name):
 
 def does_table_exist(db, table_name):
     '''Checks if a table with specified name exists in an sqlite db'''
+    query = "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?"
     try:
-        query = f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'"
-        cursor = db.execute(query)
+        cursor = db.execute(query, (table_name,))
         for row in cursor:
             return True
-    except sqlite3Error as ex:
+    except sqlite3.Error as ex:
         logfunc(f"Query error, query={query} Error={str(ex)}")
     return False
 
@@ -137,18 +191,37 @@ class GuiWindow:
             GuiWindow.progress_bar_handle.UpdateBar(n)
 
 
+_log_files = {}  # path -> open append stream, shared by logfunc and logdevinfo
+
+
+def _get_log_file(path):
+    '''Returns a line buffered append stream for path, opening it on first use. Line buffering means each
+       message is on disk as soon as it is logged, even if a native library later crashes the process.'''
+    log_file = _log_files.get(path)
+    if log_file is None:
+        log_file = open(path, 'a', encoding='utf8', buffering=1)
+        _log_files[path] = log_file
+    return log_file
+
+
+@atexit.register
+def close_log_files():
+    '''Closes the log streams, call once a run is finished so its report folder isn't kept locked'''
+    for log_file in _log_files.values():
+        log_file.close()
+    _log_files.clear()
+
+
 def logfunc(message=""):
-    with open(OutputParameters.screen_output_file_path, 'a', encoding='utf8') as a:
-        print(message)
-        a.write(message + '<br>' + OutputParameters.nl)
+    print(message)
+    _get_log_file(OutputParameters.screen_output_file_path).write(message + '<br>' + OutputParameters.nl)
 
     if GuiWindow.window_handle:
         GuiWindow.window_handle.refresh()
 
 
 def logdevinfo(message=""):
-    with open(OutputParameters.screen_output_file_path_devinfo, 'a', encoding='utf8') as b:
-        b.write(message + '<br>' + OutputParameters.nl)
+    _get_log_file(OutputParameters.screen_output_file_path_devinfo).write(message + '<br>' + OutputParameters.nl)
 
 
 """ def deviceinfoin(ordes, kas, vas, sources): # unused function
@@ -160,46 +233,66 @@ def logdevinfo(message=""):
     db.commit() """
 
 
-def html2csv(reportfolderbase):
-    # List of items that take too long to convert or that shouldn't be converted
-    itemstoignore = ['index.html',
-                     'Distribution Keys.html',
-                     'StrucMetadata.html',
-                     'StrucMetadataCombined.html']
+# List of items that take too long to convert or that shouldn't be converted
+HTML2CSV_ITEMS_TO_IGNORE = frozenset(['index.html',
+                                      'Distribution Keys.html',
+                                      'StrucMetadata.html',
+                                      'StrucMetadataCombined.html'])
+
+
+def _iter_html_reports(report_folder):
+    '''Yields the paths of the .html files under report_folder to convert, names and types come from the
+       dir entries so no stat is needed. The order is that of sorted(os.walk(report_folder)): folders
+       sorted by path, files in directory order, as it decides how same named CSVs are concatenated.'''
+    html_files_by_folder = []
+    pending = [report_folder]
+    while pending:
+        folder = pending.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError:  # unreadable, os.walk skipped these too
+            continue
+        html_files = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():  # os.walk doesn't follow links either
+                    pending.append(entry.path)
+            elif entry.name.endswith('.html') and entry.name not in HTML2CSV_ITEMS_TO_IGNORE:
+                html_files.append(entry.name)
+        html_files_by_folder.append((folder, html_files))
+
+    for folder, html_files in sorted(html_files_by_folder):
+        for name in html_files:
+            yield os.path.join(folder, name)
+
 
+def html2csv(reportfolderbase):
     if os.path.isdir(os.path.join(reportfolderbase, '_CSV Exports')):
         pass
     else:
         os.makedirs(os.path.join(reportfolderbase, '_CSV Exports'))
-    for root, dirs, files in sorted(os.walk(reportfolderbase)):
-        for file in files:
-            if file.endswith(".html"):
-                fullpath = (os.path.join(root, file))
-                head, tail = os.path.split(fullpath)
-                if file in itemstoignore:
-                    pass
-                else:
-                    data = open(fullpath, 'r', encoding='utf8')
-                    soup = BeautifulSoup(data, 'html.parser')
-                    tables = soup.find_all("table")
-                    data.close()
-                    output_final_rows = []
-
-                    for table in tables:
-                        output_rows = []
-                        for table_row in table.findAll('tr'):
+    for fullpath in _iter_html_reports(reportfolderbase):
+        with open(fullpath, 'r', encoding='utf8') as data:
+            soup = BeautifulSoup(data, 'lxml', parse_only=SoupStrainer('table'))
+        tables = soup.find_all('table')
+        if not tables:
+            continue
+        output_final_rows = []
 
-                            columns = table_row.findAll('td')
-                            output_row = []
-                            for column in columns:
-                                output_row.append(column.text)
-                            output_rows.append(output_row)
+        for table in tables:
+            for table_row in table.find_all('tr'):
+                output_final_rows.append([column.text for column in table_row.find_all('td')])
 
-                        file = (os.path.splitext(file)[0])
-                        with codecs.open(os.path.join(reportfolderbase, '_CSV Exports', file + '.csv'), 'a',
-                                         'utf-8-sig') as csvfile:
-                            writer = csv.writer(csvfile, quotechar='"', quoting=csv.QUOTE_ALL)
-                            writer.writerows(output_rows)
+        file = os.path.splitext(os.path.basename(fullpath))[0]
+        with open(os.path.join(reportfolderbase, '_CSV Exports', file + '.csv'), 'a',
+                  encoding='utf-8-sig', newline='', buffering=1024 * 1024) as csvfile:
+            writer = csv.writer(csvfile, quotechar='"', quoting=csv.QUOTE_ALL)
+            writer.writerows(output_final_rows)
 
 
 def tsv(report_folder, data_headers, data_list, tsvname, source_file=None):
@@ -213,31 +306,45 @@ def tsv(report_folder, data_headers, data_list, tsvname, source_file=None):
     else:
         os.makedirs(tsv_report_folder)
 
-    if os.path.exists(os.path.join(tsv_report_folder, tsvname + '.tsv')):
-        with codecs.open(os.path.join(tsv_report_folder, tsvname + '.tsv'), 'a') as tsvfile:
-            tsv_writer = csv.writer(tsvfile, delimiter='\t')
-            for i in data_list:
-                if source_file == None:
-                    tsv_writer.writerow(i)
-                else:
-                    row_data = list(i)
-                    row_data.append(source_file)
-                    tsv_writer.writerow(tuple(row_data))
+    tsv_path = os.path.join(tsv_report_folder, tsvname + '.tsv')
+    need_header = not os.path.exists(tsv_path)
+    if source_file == None:
+        rows = data_list
     else:
-        with codecs.open(os.path.join(tsv_report_folder, tsvname + '.tsv'), 'a', 'utf-8-sig') as tsvfile:
-            tsv_writer = csv.writer(tsvfile, delimiter='\t')
-            if source_file == None:
-                tsv_writer.writerow(data_headers)
-                for i in data_list:
-                    tsv_writer.writerow(i)
-            else:
-                data_hdr = list(data_headers)
-                data_hdr.append("source file")
-                tsv_writer.writerow(tuple(data_hdr))
-                for i in data_list:
-                    row_data = list(i)
-                    row_data.append(source_file)
-                    tsv_writer.writerow(tuple(row_data))
+        data_headers = (*data_headers, 'source file')
+        rows = [(*row, source_file) for row in data_list]
+
+    with open(tsv_path, 'a', encoding='utf-8-sig', newline='', buffering=1 << 20) as tsvfile:
+        tsv_writer = csv.writer(tsvfile, delimiter='\t')
+        if need_header:
+            tsv_writer.writerow(data_headers)
+        tsv_writer.writerows(rows)
+
+
+_sidecar_dbs = {}  # path -> connection to one of the report's own dbs, see _open_sidecar_db
+
+
+def _open_sidecar_db(path, schema):
+    '''Returns the connection to a db that the report writes to (timeline, KML, usernames, IP addresses).
+       It is opened once per run, creating its folder and table if needed, and is in autocommit mode,
+       so writers open their own transaction.'''
+    db = _sidecar_dbs.get(path)
+    if db is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = sqlite3.connect(path, isolation_level=None)
+        db.executescript('PRAGMA journal_mode = WAL; PRAGMA synchronous = NORMAL; PRAGMA cache_size = -20000; '
+                         'PRAGMA temp_store = MEMORY; PRAGMA mmap_size = 268435456;')
+        db.execute(schema)
+        _sidecar_dbs[path] = db
+    return db
+
+
+@atexit.register
+def close_sidecar_dbs():
+    '''Closes the dbs opened by _open_sidecar_db, call once all artifacts have been processed'''
+    for db in _sidecar_dbs.values():
+        db.close()
+    _sidecar_dbs.clear()
 
 
 def timeline(report_folder, tlactivity, data_list, data_headers):
@@ -246,33 +353,14 @@ def timeline(report_folder, tlactivity, data_list, data_headers):
     report_folder_base, tail = os.path.split(report_folder)
     tl_report_folder = os.path.join(report_folder_base, '_Timeline')
 
-    if os.path.isdir(tl_report_folder):
-        tldb = os.path.join(tl_report_folder, 'tl.db')
-        db = sqlite3.connect(tldb)
-        cursor = db.cursor()
-        cursor.execute('''PRAGMA synchronous = EXTRA''')
-        cursor.execute('''PRAGMA journal_mode = WAL''')
-    else:
-        os.makedirs(tl_report_folder)
-        # create database
-        tldb = os.path.join(tl_report_folder, 'tl.db')
-        db = sqlite3.connect(tldb, isolation_level='exclusive')
-        cursor = db.cursor()
-        cursor.execute(
-            """
-        CREATE TABLE data(key TEXT, activity TEXT, datalist TEXT)
-        """
-        )
-        db.commit()
-
-    a = 0
-    length = (len(data_list))
-    while a < length:
-        modifiedList = list(map(lambda x, y: x + ': ' + str(y), data_headers, data_list[a]))
-        cursor.executemany("INSERT INTO data VALUES(?,?,?)", [(str(data_list[a][0]), tlactivity, str(modifiedList))])
-        a += 1
-    db.commit()
-    db.close()
+    db = _open_sidecar_db(os.path.join(tl_report_folder, 'tl.db'),
+                          'CREATE TABLE IF NOT EXISTS data(key TEXT, activity TEXT, datalist TEXT)')
+
+    rows = [(str(row[0]), tlactivity, str(list(map(lambda x, y: x + ': ' + str(y), data_headers, row))))
+            for row in data_list]
+    with db:  # commits, or rolls back on error
+        db.execute('BEGIN IMMEDIATE')
+        db.executemany("INSERT INTO data VALUES(?,?,?)", rows)
 
 
 def kmlgen(report_folder, kmlactivity, data_list, data_headers):
@@ -281,44 +369,37 @@ def kmlgen(report_folder, kmlactivity, data_list, data_headers):
     report_folder_base, tail = os.path.split(report_folder)
     kml_report_folder = os.path.join(report_folder_base, '_KML Exports')
 
-    if os.path.isdir(kml_report_folder):
-        latlongdb = os.path.join(kml_report_folder, '_latlong.db')
-        db = sqlite3.connect(latlongdb)
-        cursor = db.cursor()
-        cursor.execute('''PRAGMA synchronous = EXTRA''')
-        cursor.execute('''PRAGMA journal_mode = WAL''')
-        db.commit()
-    else:
-        os.makedirs(kml_report_folder)
-        latlongdb = os.path.join(kml_report_folder, '_latlong.db')
-        db = sqlite3.connect(latlongdb)
-        cursor = db.cursor()
-        cursor.execute(
-            """
-        CREATE TABLE data(key TEXT, latitude TEXT, longitude TEXT, activity TEXT)
-        """
-        )
-        db.commit()
+    db = _open_sidecar_db(os.path.join(kml_report_folder, '_latlong.db'),
+                          'CREATE TABLE IF NOT EXISTS data(key TEXT, latitude TEXT, longitude TEXT, activity TEXT)')
 
     kml = simplekml.Kml(open=1)
-
-    a = 0
-    length = (len(data_list))
-    while a < length:
-        modifiedDict = dict(zip(data_headers, data_list[a]))
-        times = modifiedDict['Timestamp']
-        lon = modifiedDict['Longitude']
-        lat = modifiedDict['Latitude']
-        if lat:
-            pnt = kml.newpoint()
-            pnt.name = times
-            pnt.description = f"Timestamp: {times} - {kmlactivity}"
-            pnt.coords = [(lon, lat)]
-            cursor.execute("INSERT INTO data VALUES(?,?,?,?)", (times, lat, lon, kmlactivity))
-        a += 1
-    db.commit()
-    db.close()
-    kml.save(os.path.join(kml_report_folder, f'{kmlactivity}.kml'))
+    kml_path = os.path.join(kml_report_folder, f'{kmlactivity}.kml')
+    if not data_list:  # nothing to place, but still write the (empty) kml as before
+        kml.save(kml_path)
+        return
+
+    # Last position of each header, as dict(zip(data_headers, row)) would pick for duplicates
+    header_index = {header: index for index, header in enumerate(data_headers)}
+    times_index = header_index['Timestamp']
+    lon_index = header_index['Longitude']
+    lat_index = header_index['Latitude']
+
+    rows = []
+    for row in data_list:
+        lat = row[lat_index]
+        if not lat:  # most rows of most artifacts have no location
+            continue
+        times = row[times_index]
+        lon = row[lon_index]
+        pnt = kml.newpoint()
+        pnt.name = times
+        pnt.description = f"Timestamp: {times} - {kmlactivity}"
+        pnt.coords = [(lon, lat)]
+        rows.append((times, lat, lon, kmlactivity))
+    with db:  # commits, or rolls back on error
+        db.execute('BEGIN IMMEDIATE')
+        db.executemany("INSERT INTO data VALUES(?,?,?,?)", rows)
+    kml.save(kml_path)
 
 
 """
@@ -343,6 +424,13 @@ SOFTWARE.
 
 def utf8_in_extended_ascii(input_string, *, raise_on_unexpected=False):
     """Returns a tuple of bool (whether mis-encoded utf-8 is present) and str (the converted string)"""
+    if not raise_on_unexpected:
+        # Fast path, let the regex engine find the sequences and decode them in C. Anything that isn't
+        # well-formed utf-8 is left as is. Unlike the loop below, which dumps a broken sequence without
+        # looking inside it, the regex resyncs on the next valid sequence: '\xc3\xc3\xa9' -> 'Ãé', not 'ÃÃ©'.
+        output, count = _RE.UTF8_SEQ.subn(lambda m: m.group(0).encode('latin-1').decode('utf-8'), input_string)
+        return count > 0, output
+
     output = []  # individual characters, join at the end
     is_in_multibyte = False  # True if we're currently inside a utf-8 multibyte character
     multibytes_expected = 0
@@ -400,7 +488,46 @@ def utf8_in_extended_ascii(input_string, *, raise_on_unexpected=False):
     return mis_encoded_utf8_present, "".join(output)
 
 
-def media_to_html(media_path, files_found, report_folder):
+_FICLONE = getattr(fcntl, 'FICLONE', 0x40049409)  # only exposed by python 3.12+
+
+
+def copy_media_file(source, target_folder):
+    '''Copies source into target_folder keeping its metadata, like shutil.copy2. On Linux it first tries a
+       copy-on-write clone (btrfs, XFS), which shares the data blocks but is still an independent copy,
+       so nothing done to the report can touch the original. Returns the path of the copy.
+       If the target already is the source (same path, or a hard link to it), it is left untouched.'''
+    target = os.path.join(target_folder, os.path.basename(source))
+    if os.path.exists(target) and os.path.samefile(source, target):
+        return target  # never open the evidence for writing
+    if fcntl is not None and sys.platform.startswith('linux'):
+        # Clone into a new file and move it over the target, so no existing inode is ever truncated
+        temp_target = target + '.clone-tmp'
+        temp_created = False
+        try:
+            with open(source, 'rb') as src, open(temp_target, 'xb') as dst:
+                temp_created = True
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            shutil.copystat(source, temp_target)
+            os.replace(temp_target, target)
+            return target
+        except OSError:  # not supported by this filesystem, or source and target are on different ones
+            if temp_created:
+                os.remove(temp_target)
+    return shutil.copy2(source, target)
+
+
+def build_files_index(files_found):
+    '''Groups files_found by file name, build it once per artifact and pass it to media_to_html'''
+    files_index = {}
+    for file_found in files_found:
+        files_index.setdefault(os.path.basename(file_found), []).append(file_found)
+    return files_index
+
+
+def media_to_html(media_path, files_found, report_folder, files_index=None):
+    '''Returns the html to show media_path in a report. Passing files_index (see build_files_index)
+       avoids scanning all of files_found on every call when media_path ends in a full file name,
+       otherwise (e.g. a name without its extension) all of files_found is still searched.'''
     def media_path_filter(name):
         return media_path in name
 
@@ -413,15 +540,20 @@ def media_to_html(media_path, files_found, report_folder):
         splitted_b = source.split(report_folder)
         return '.' + splitted_b[1]
 
-    platform = is_platform_windows()
-    if platform:
+    if _IS_WINDOWS:
         media_path = media_path.replace('/', '\\')
         splitter = '\\'
     else:
         splitter = '/'
 
+    candidates = None
+    if files_index is not None:
+        candidates = files_index.get(os.path.basename(media_path))
+    if not candidates:  # no exact file name match, fall back to the substring search over everything
+        candidates = files_found
+
     thumb = media_path
-    for match in filter(media_path_filter, files_found):
+    for match in filter(media_path_filter, candidates):
         filename = os.path.basename(match)
         if filename.startswith('~') or filename.startswith('._'):
             continue
@@ -439,7 +571,7 @@ def media_to_html(media_path, files_found, report_folder):
             filename = filename.name
             locationfiles = Path(report_folder).joinpath(dirname)
             Path(f'{locationfiles}').mkdir(parents=True, exist_ok=True)
-            shutil.copy2(match, locationfiles)
+            copy_media_file(match, locationfiles)
             source = Path(locationfiles, filename)
             source = relative_paths(str(source), splitter)
 
@@ -462,37 +594,15 @@ def usergen(report_folder, data_list_usernames):
     report_folder_base, tail = os.path.split(report_folder)
     udb_report_folder = os.path.join(report_folder_base, '_Usernames DB')
 
-    if os.path.isdir(udb_report_folder):
-        usernames = os.path.join(udb_report_folder, '_usernames.db')
-        db = sqlite3.connect(usernames)
-        cursor = db.cursor()
-        cursor.execute('''PRAGMA synchronous = EXTRA''')
-        cursor.execute('''PRAGMA journal_mode = WAL''')
-        db.commit()
-    else:
-        os.makedirs(udb_report_folder)
-        usernames = os.path.join(udb_report_folder, '_usernames.db')
-        db = sqlite3.connect(usernames)
-        cursor = db.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE data(username TEXT, appname TEXT, artifactname text, html_report text, data TEXT)
-            """
-        )
-        db.commit()
-
-    a = 0
-    length = (len(data_list_usernames))
-    while a < length:
-        user = data_list_usernames[a][0]
-        app = data_list_usernames[a][1]
-        artifact = data_list_usernames[a][2]
-        html_report = data_list_usernames[a][3]
-        data = data_list_usernames[a][4]
-        cursor.execute("INSERT INTO data VALUES(?,?,?,?,?)", (user, app, artifact, html_report, data))
-        a += 1
-    db.commit()
-    db.close()
+    db = _open_sidecar_db(os.path.join(udb_report_folder, '_usernames.db'),
+                          'CREATE TABLE IF NOT EXISTS data(username TEXT, appname TEXT, artifactname text, '
+                          'html_report text, data TEXT)')
+
+    # user, app, artifact, html_report, data
+    rows = [(row[0], row[1], row[2], row[3], row[4]) for row in data_list_usernames]
+    with db:  # commits, or rolls back on error
+        db.execute('BEGIN IMMEDIATE')
+        db.executemany("INSERT INTO data VALUES(?,?,?,?,?)", rows)
 
 
 def ipgen(report_folder, data_list_ipaddress):
@@ -501,77 +611,120 @@ def ipgen(report_folder, data_list_ipaddress):
     report_folder_base, tail = os.path.split(report_folder)
     udb_report_folder = os.path.join(report_folder_base, '_IPAddress DB')
 
-    if os.path.isdir(udb_report_folder):
-        ipaddress = os.path.join(udb_report_folder, '_ipaddresses.db')
-        db = sqlite3.connect(ipaddress)
-        cursor = db.cursor()
-        cursor.execute('''PRAGMA synchronous = EXTRA''')
-        cursor.execute('''PRAGMA journal_mode = WAL''')
-        db.commit()
-    else:
-        os.makedirs(udb_report_folder)
-        ipaddress = os.path.join(udb_report_folder, '_ipaddresses.db')
-        db = sqlite3.connect(ipaddress)
-        cursor = db.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE data(ipaddress TEXT, appname TEXT, artifactname text, html_report text, data TEXT)
-            """
-        )
-        db.commit()
-
-    a = 0
-    length = (len(data_list_ipaddress))
-    while a < length:
-        ip_address = data_list_ipaddress[a][0]
-        app = data_list_ipaddress[a][1]
-        artifact = data_list_ipaddress[a][2]
-        html_report = data_list_ipaddress[a][3]
-        data = data_list_ipaddress[a][4]
-        cursor.execute("INSERT INTO data VALUES(?,?,?,?,?)", (ip_address, app, artifact, html_report, data))
-        a += 1
-    db.commit()
-    db.close()
-
-
-def _count_generator(reader):
-    b = reader(1024 * 1024)
-    while b:
-        yield b
-        b = reader(1024 * 1024)
-
-
-def _get_line_count(file):
-    with open(file, 'rb') as fp:
-        return sum(buffer.count(b'\n') for buffer in _count_generator(fp.raw.read))
+    db = _open_sidecar_db(os.path.join(udb_report_folder, '_ipaddresses.db'),
+                          'CREATE TABLE IF NOT EXISTS data(ipaddress TEXT, appname TEXT, artifactname text, '
+                          'html_report text, data TEXT)')
+
+    # ip_address, app, artifact, html_report, data
+    rows = [(row[0], row[1], row[2], row[3], row[4]) for row in data_list_ipaddress]
+    with db:  # commits, or rolls back on error
+        db.execute('BEGIN IMMEDIATE')
+        db.executemany("INSERT INTO data VALUES(?,?,?,?,?)", rows)
+
+
+# Pattern tokens whose meaning changes when a str pattern is run against the whole file as bytes
+_UNSAFE_BYTES_TOKENS = frozenset(['\\w', '\\W', '\\s', '\\S', '\\d', '\\D', '\\b', '\\B', '\\A', '\\Z',
+                                  '\\x', '\\u', '\\U', '\\N'])
+
+
+def _bytes_prefilter(regex: Pattern):
+    '''Returns regex compiled for bytes, to find the lines that may match without decoding the file, or None
+       if the bytes version could miss a line the str regex matches. That is the case for non-ascii
+       patterns, case folding, classes like \\w or [^...], escapes of non-ascii characters, a '.' not
+       followed by * or + (a character may take several bytes), \\A, \\Z, negative lookarounds (which
+       would see the neighbouring lines) and inline flags. Multiline mode makes ^ and $ match at every
+       line, so the bytes regex matches at least the lines the str regex matches.'''
+    pattern = regex.pattern
+    if not isinstance(pattern, str) or not pattern.isascii() or regex.flags & re.IGNORECASE:
+        return None
+    tokens = re.findall(r'\\.|.', pattern, re.DOTALL)
+    for index, token in enumerate(tokens):
+        following = ''.join(tokens[index + 1:index + 4])
+        if token in _UNSAFE_BYTES_TOKENS or (token[0] == '\\' and token[1:].isdigit()):
+            return None
+        if token == '.' and following[:1] not in ('*', '+'):
+            return None
+        if token == '[' and following.startswith('^'):
+            return None
+        if token == '(' and re.match(r'\?([aiLmsux!-]|<!)', following):
+            return None
+    return re.compile(pattern.encode('ascii'), (regex.flags & ~re.UNICODE) | re.MULTILINE)
 
 
 def gather_hashes_in_file(file_found: str, regex: Pattern):
+    '''Collects the target hashes from the json lines of a log file. regex is run against each line and its
+       group 1 must capture the comma separated hash list.'''
     target_hashes = {}
 
-    factor = int(_get_line_count(file_found) / 100)
+    def gather_from_line(line):
+        result = regex.search(line)
+        if not result:
+            return
+
+        try:
+            deserialized = _json_loads(line)
+        except ValueError:  # orjson rejects lone surrogate escapes and NaN, which json accepts
+            deserialized = json.loads(line)
+        eventmessage = deserialized.get('eventMessage', '')
+        eventtimestamp = deserialized.get('timestamp', '')[0:25]
+        subsystem = deserialized.get('subsystem', '')
+        category = deserialized.get('category', '')
+        traceid = deserialized.get('traceID', '')
+
+        for hash in _RE.HASH_TOKEN.findall(result.group(1)):
+            targetstart = hash[:5]
+            targetend = hash[-5:]
+
+            # We assume same hash equals same phone
+            if (targetstart, targetend) not in target_hashes:
+                logfunc(f"Add {targetstart}...{targetend} to target list")
+                target_hashes[(targetstart, targetend)] = [eventtimestamp, None, eventmessage,
+                                                           subsystem, category, traceid]
+
+    total_size = os.path.getsize(file_found)
+    if total_size == 0:
+        return target_hashes
+    set_progress_bar = GuiWindow.SetProgressBar
+    progress_step = max(total_size // 100, 1)
+    next_progress = progress_step
+
+    prefilter = _bytes_prefilter(regex)
+    if prefilter is not None:
+        with open(file_found, 'rb') as data, mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Text mode also ends lines at \r, so only files without any go this way
+            if mm.find(b'\r') == -1:
+                encoding = locale.getpreferredencoding(False)  # what open(file_found, 'r') decodes with
+                pos = 0
+                while pos < total_size:
+                    # Search about 1% of the file at a time, ending on a line end so no line is cut, which keeps
+                    # the progress bar moving when matches are rare
+                    window_end = mm.find(b'\n', min(pos + progress_step, total_size - 1))
+                    if window_end == -1:
+                        window_end = total_size
+                    candidate = prefilter.search(mm, pos, window_end)
+                    if candidate:
+                        line_start = mm.rfind(b'\n', 0, candidate.start()) + 1
+                        line_end = mm.find(b'\n', candidate.start(), window_end)
+                        if line_end == -1:
+                            line_end = window_end
+                        pos = line_end + 1
+                        # Same text, trailing newline included, that the line-by-line scan below gives regex
+                        gather_from_line(mm[line_start:pos].decode(encoding))
+                    else:
+                        pos = window_end + 1
+
+                    # Refresh the progress bar each time another 1% of the file is done, and not at all when headless
+                    if pos >= next_progress and GuiWindow.window_handle:
+                        set_progress_bar(int(min(pos, total_size) * 100 / total_size))
+                        next_progress = pos + progress_step
+                return target_hashes
+
+    # The pattern can't be prefiltered as bytes, check every line
     with open(file_found, 'r') as data:
         for i, x in enumerate(data):
-            if i % factor == 0:
-                GuiWindow.SetProgressBar(int(i / factor))
-
-            result = regex.search(x)
-            if not result:
-                continue
-
-            for hash in result.group(1).split(", "):
-                deserialized = json.loads(x)
-                eventmessage = deserialized.get('eventMessage', '')
-                targetstart = hash[:5]
-                targetend = hash[-5:]
-                eventtimestamp = deserialized.get('timestamp', '')[0:25]
-                subsystem = deserialized.get('subsystem', '')
-                category = deserialized.get('category', '')
-                traceid = deserialized.get('traceID', '')
-
-                # We assume same hash equals same phone
-                if (targetstart, targetend) not in target_hashes:
-                    logfunc(f"Add {targetstart}...{targetend} to target list")
-                    target_hashes[(targetstart, targetend)] = [eventtimestamp, None, eventmessage,
-                                                               subsystem, category, traceid]
+            # tell() is disabled on the text layer while iterating, the binary buffer's is not
+            if (i & 1023) == 0 and GuiWindow.window_handle and data.buffer.tell() >= next_progress:
+                set_progress_bar(int(data.buffer.tell() * 100 / total_size))
+                next_progress = data.buffer.tell() + progress_step
+            gather_from_line(x)
     return target_hashes